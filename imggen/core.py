@@ -4,19 +4,35 @@ import io
 import multiprocessing
 import pathlib
 import threading
+from collections import OrderedDict
 from collections.abc import MutableMapping
-from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import AbstractContextManager
-from typing import Any, Callable, Dict, Optional, Tuple, Type, Union, overload
-
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Iterable
+from typing import MutableMapping as MutableMappingType
+from typing import NamedTuple, Optional, Tuple, Type, Union, overload
+
+# Pillow-SIMD is a drop-in replacement for Pillow (same `PIL` package and ABI)
+# with vectorized resize/composite kernels; install it in place of Pillow with
+#   CC="cc -mavx2" pip install -U --force-reinstall pillow-simd
+# Both Pillow wheels and Pillow-SIMD link libjpeg-turbo for SIMD JPEG codecs.
 from PIL import Image, ImageDraw, ImageFont
 
 ImageCacheDict = Dict[str, Image.Image]
-FontCacheDict = Dict[str, bytes]
+SharedImageDict = MutableMappingType[str, Tuple[str, Tuple[int, int], str, str]]
+FontCacheDict = Dict[Tuple[str, int], ImageFont.FreeTypeFont]
 ImageType = Union[Image.Image, bytes, io.BytesIO, str]
 
 PathType = Union[str, pathlib.Path]
 
+# Encoder settings per output format: single-pass Huffman baseline JPEGs and
+# fast zlib PNGs (larger files, much cheaper to encode)
+SAVE_OPTIONS: Dict[str, Dict[str, Any]] = {
+    "JPEG": {"quality": 85, "optimize": False, "progressive": False, "subsampling": 2},
+    "PNG": {"compress_level": 1},
+}
+
 
 class AssetCache(MutableMapping):
     def __init__(
@@ -34,6 +50,12 @@ class AssetCache(MutableMapping):
         with self.lock:
             self.cache_dict[key] = value
 
+    def publish(self, key, value):
+        # Only writers take the lock; if another thread loaded the same
+        # asset first, keep and return its copy
+        with self.lock:
+            return self.cache_dict.setdefault(key, value)
+
     def __delitem__(self, key: str) -> None:
         with self.lock:
             del self.cache_dict[key]
@@ -56,16 +78,175 @@ class ImageCache(AssetCache):
         super().__init__(cache_dict=cache_dict, basepath=basepath, lock=lock)
 
     def __getitem__(self, key: str) -> Image.Image:
+        return self.get_readonly(key).copy()
+
+    def get_readonly(self, key: str) -> Image.Image:
+        # Returns the shared cached image; callers must not mutate it
+        # Plain dict reads are atomic, so the hit path skips the lock
+        cached = self.cache_dict.get(key)
+        if cached is not None:
+            return cached
+
+        return self.publish(key, self.open(key))
+
+    def open(self, key: str) -> Image.Image:
+        # Decode eagerly so copies don't re-decode
+        img = Image.open(self.basepath / key)
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        return img
+
+    def preload(self) -> None:
+        for path in self.basepath.iterdir():
+            if path.is_file():
+                self.get_readonly(path.name)
+
+
+# Decoded pixels live in shared memory segments. shared_dict (for example a
+# multiprocessing.Manager().dict()) maps each template to
+# (segment name, size, mode, buffer mode), so a template is decoded once across
+# all processes and the others wrap the existing segment as a read-only image.
+# Entries are published with setdefault, which must be atomic on the mapping
+# (it is for a plain dict and for Manager dict proxies).
+class SharedImageCache(ImageCache):
+    def __init__(
+        self,
+        *,
+        cache_dict: ImageCacheDict,
+        basepath: PathType,
+        lock: AbstractContextManager,
+        shared_dict: SharedImageDict,
+    ):
+        super().__init__(cache_dict=cache_dict, basepath=basepath, lock=lock)
+        self.shared_dict = shared_dict
+        self.segments: Dict[str, shared_memory.SharedMemory] = {}
+        self.owned: Dict[str, shared_memory.SharedMemory] = {}
+        self.modes: Dict[str, str] = {}
+
+    def __getitem__(self, key: str) -> Image.Image:
+        img = self.get_readonly(key)
+        # Segments are stored in a mappable mode; convert back, which also
+        # makes the writable copy callers expect
+        # Images pre-seeded through cache_dict are not in shared memory
+        mode = self.modes.get(key, img.mode)
+        return img.convert(mode) if img.mode != mode else img.copy()
+
+    def get_readonly(self, key: str) -> Image.Image:
+        cached = self.cache_dict.get(key)
+        if cached is not None:
+            return cached
+
         with self.lock:
-            # In cache
             if key in self.cache_dict:
-                return self.cache_dict[key].copy()
+                return self.cache_dict[key]
+
+            while True:
+                meta = self.shared_dict.get(key)
+                if meta is None:
+                    shm, meta = self.create_segment(key)
+                    # setdefault is the compare-and-set: another process may
+                    # have published this template since the get above
+                    winner = self.shared_dict.setdefault(key, meta)
+                    if winner[0] == shm.name:
+                        self.owned[key] = shm
+                        break
+                    shm.close()
+                    shm.unlink()
+                    continue
+
+                try:
+                    shm = shared_memory.SharedMemory(name=meta[0])
+                    break
+                except FileNotFoundError:
+                    # The creating process exited without close() and its
+                    # resource tracker removed the segment; treat as a miss
+                    self.discard(key, meta[0])
+
+            name, size, mode, bufmode = meta
+            self.segments[key] = shm
+            self.modes[key] = mode
+            img = Image.frombuffer(bufmode, size, shm.buf, "raw", bufmode, 0, 1)
+            self.cache_dict[key] = img
+
+        return img
+
+    def create_segment(
+        self, key: str
+    ) -> Tuple[shared_memory.SharedMemory, Tuple[str, Tuple[int, int], str, str]]:
+        img = self.open(key)
+        # frombuffer can only map 1 or 4 byte-per-pixel modes
+        bufmode = "RGBX" if img.mode == "RGB" else img.mode
+        data = img.convert(bufmode).tobytes()
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        shm.buf[: len(data)] = data
+        return shm, (shm.name, img.size, img.mode, bufmode)
+
+    def discard(self, key: str, name: str) -> None:
+        # Only remove the entry if it still names this segment. The mapping
+        # has no compare-and-delete, so losing this race costs another
+        # process a duplicate decode at most, never a broken entry.
+        meta = self.shared_dict.get(key)
+        if meta is not None and meta[0] == name:
+            self.shared_dict.pop(key, None)
+
+    def close(self) -> None:
+        # Views returned by get_readonly must not outlive close(). Segments
+        # this process created are unlinked even if a view is still alive;
+        # those segments stay attached (close() can be retried once the views
+        # are gone) and BufferError is raised after everything else is done.
+        busy = {}
+        with self.lock:
+            for key in self.segments:
+                self.cache_dict.pop(key, None)
+            for key, shm in self.segments.items():
+                try:
+                    shm.close()
+                except BufferError:
+                    busy[key] = shm
+                finally:
+                    if self.owned.pop(key, None) is not None:
+                        try:
+                            shm.unlink()
+                        except FileNotFoundError:
+                            # Already removed, e.g. by a resource tracker
+                            pass
+                        self.discard(key, shm.name)
+            self.segments = busy
+
+        if busy:
+            raise BufferError(f"Views of {', '.join(busy)} are still in use")
+
+
+# LRU of encoded outputs bounded by their total size in bytes rather than by
+# entry count, since a single rendered template can be hundreds of KB
+class OutputCache:
+    def __init__(self, *, max_bytes: int, lock: AbstractContextManager):
+        self.max_bytes = max_bytes
+        self.lock = lock
+        self.nbytes = 0
+        self.entries: "OrderedDict[Any, bytes]" = OrderedDict()
 
-        # Load and populate cache
-        img = Image.open(self.basepath / key)
-        self[key] = img
+    def get(self, key: Any) -> Optional[bytes]:
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key: Any, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
 
-        return img.copy()
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self.entries[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= len(evicted)
 
 
 class FontCache(AssetCache):
@@ -81,19 +262,18 @@ class FontCache(AssetCache):
     def __getitem__(self, key: Tuple[str, int]) -> ImageFont.FreeTypeFont:
         filename, size = key
 
-        with self.lock:
-            if filename in self.cache_dict:
-                return ImageFont.truetype(
-                    io.BytesIO(self.cache_dict[filename]), size=size
-                )
-
-        with open(self.basepath / filename, "rb") as f:
-            fontbytes = f.read()
+        cached = self.cache_dict.get(key)
+        if cached is not None:
+            return cached
 
-        font = ImageFont.truetype(io.BytesIO(fontbytes), size=size)
-        self.cache_dict[filename] = fontbytes
+        # Load from the path so FreeType maps the file itself
+        font = ImageFont.truetype(str(self.basepath / filename), size=size)
+        return self.publish(key, font)
 
-        return font
+    def preload(self, sizes: Iterable[int]) -> None:
+        for path in self.basepath.glob("*.ttf"):
+            for size in sizes:
+                self[path.name, size]
 
 
 def generator(func: Callable):
@@ -101,6 +281,35 @@ def generator(func: Callable):
     return func
 
 
+class TextSpec(NamedTuple):
+    image: str
+    fontname: str
+    size: int
+    center: Tuple[int, int]
+    fill: Tuple[int, int, int] = (0, 0, 0)
+    format: str = "JPEG"
+
+
+class _GeneratorFactory:
+    # Placeholder that swaps itself for the real method once the attribute
+    # name it was assigned to is known, so it reads well in tracebacks/help
+    def __init__(self, func: Callable):
+        self.func = func
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.func.__name__ = name
+        self.func.__qualname__ = f"{owner.__qualname__}.{name}"
+        setattr(owner, name, generator(self.func))
+
+
+def text_generator(spec: TextSpec):
+    # Builds a generator method for templates that only take a caption
+    def func(self, text: str):
+        return self.writespec(spec, text)
+
+    return _GeneratorFactory(func)
+
+
 class Generator:
     def __init__(self, func, *, gen: "BaseImageGenerator"):
         self.func = func
@@ -108,6 +317,10 @@ class Generator:
 
     def __call__(self, *args: Any, **kwargs: Any) -> Any:
         if self.gen.async_mode:
+            if not kwargs:
+                return self.gen.loop.run_in_executor(
+                    self.gen.executor, self.func, *args
+                )
             return self.gen.loop.run_in_executor(
                 self.gen.executor, functools.partial(self.func, *args, **kwargs)
             )
@@ -115,12 +328,22 @@ class Generator:
 
 
 class BaseImageGenerator:
+    _generator_attrs: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        # Collected once per class (including inherited generators) rather
+        # than walking dir() for every instance
+        cls._generator_attrs = tuple(
+            attr_name
+            for attr_name in dir(cls)
+            if getattr(getattr(cls, attr_name, None), "__image_generator__", False)
+        )
+
     def __new__(cls, *args, **kwargs) -> Any:
         self = super().__new__(cls)
-        for attr_name in dir(self):
-            attr = getattr(self, attr_name)
-            if getattr(attr, "__image_generator__", False):
-                setattr(self, attr_name, Generator(attr, gen=self))
+        for attr_name in cls._generator_attrs:
+            setattr(self, attr_name, Generator(getattr(self, attr_name), gen=self))
 
         return self
 
@@ -134,8 +357,15 @@ class BaseImageGenerator:
         font_basepath: Union[str, pathlib.Path],
         loop: Optional[asyncio.BaseEventLoop] = None,
         executor: Optional[Executor] = None,
+        shared_image_cache: Optional[SharedImageDict] = None,
+        output_cache_bytes: int = 32 * 1024 * 1024,
     ):
         self.loop = loop
+        # Pillow releases the GIL in its codecs and resamplers, so threads
+        # scale without pickling images across processes
+        self.owns_executor = executor is None and async_mode
+        if self.owns_executor:
+            executor = ThreadPoolExecutor()
         self.executor = executor
         self.lock_type = (
             multiprocessing.Lock
@@ -143,35 +373,84 @@ class BaseImageGenerator:
             else threading.Lock
         )
         self.async_mode = async_mode
-        self.image_cache = ImageCache(
-            cache_dict=image_cache.copy(),
-            basepath=image_basepath,
-            lock=self.lock_type(),
-        )
+        if shared_image_cache is None:
+            self.image_cache = ImageCache(
+                cache_dict=image_cache.copy(),
+                basepath=image_basepath,
+                lock=self.lock_type(),
+            )
+        else:
+            self.image_cache = SharedImageCache(
+                cache_dict=image_cache.copy(),
+                basepath=image_basepath,
+                lock=self.lock_type(),
+                shared_dict=shared_image_cache,
+            )
         self.font_cache = FontCache(
             cache_dict=font_cache.copy(), basepath=font_basepath, lock=self.lock_type()
         )
+        # Rendered output of caption-only memes keyed by (spec, text); bytes
+        # are cached so a hit never touches PIL. 0 disables it
+        self.output_cache = OutputCache(
+            max_bytes=output_cache_bytes, lock=self.lock_type()
+        )
         if async_mode and loop is None:
             self.loop = asyncio.get_event_loop()
 
-    def convert_to_image(self, image: ImageType) -> Image.Image:
-        # Conversions
-        if isinstance(image, str):
-            image = Image.open(image)
-        if isinstance(image, bytes):
-            image = io.BytesIO(image)
-        if isinstance(image, io.BytesIO):
-            image = Image.open(image)
-        if not isinstance(image, Image.Image):
-            raise TypeError("Invalid type received for image")
+    def close(self) -> None:
+        if self.owns_executor:
+            self.executor.shutdown()
+        if isinstance(self.image_cache, SharedImageCache):
+            self.image_cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    _conversions: Dict[type, Callable[[Any], Image.Image]] = {
+        Image.Image: lambda image: image,
+        bytes: lambda image: Image.open(io.BytesIO(image)),
+        io.BytesIO: Image.open,
+        str: Image.open,
+    }
+
+    def convert_to_image(
+        self, image: ImageType, *, draft: Optional[Tuple[int, int]] = None
+    ) -> Image.Image:
+        # Dispatch on the exact type first, then fall back to the MRO so that
+        # Image.Image subclasses (JpegImageFile, PngImageFile...) still match
+        convert = self._conversions.get(type(image))
+        if convert is None:
+            for cls in type(image).__mro__:
+                if cls in self._conversions:
+                    convert = self._conversions[cls]
+                    break
+            else:
+                raise TypeError("Invalid type received for image")
+
+        # Only draft images opened here; a caller's Image must not be shrunk
+        opened = not isinstance(image, Image.Image)
+        image = convert(image)
+        if draft and opened:
+            # Lets the JPEG decoder downscale in the DCT domain while decoding;
+            # a no-op for other formats
+            image.draft(None, draft)
+        image.load()
         return image
 
     def image_to_bytesio(self, image: Image.Image, format: str = "JPEG"):
         b = io.BytesIO()
-        image.save(b, format=format)
+        image.save(b, format=format, **SAVE_OPTIONS.get(format, {}))
         b.seek(0)
         return b
 
+    def image_to_bytes(self, image: Image.Image, format: str = "JPEG") -> bytes:
+        b = io.BytesIO()
+        image.save(b, format=format, **SAVE_OPTIONS.get(format, {}))
+        return b.getvalue()
+
     def paste(
         self,
         basename: str,
@@ -180,16 +459,53 @@ class BaseImageGenerator:
         *,
         format="JPEG",
         resize: Tuple[int, int] = None,
+        reducing_gap: Optional[float] = 3.0,
     ):
         base = self.image_cache[basename]
-        image = self.convert_to_image(image)
+        image = self.convert_to_image(image, draft=resize)
 
         if resize:
-            image = image.resize(resize)
-        base.paste(image, coords)
+            image = image.resize(
+                resize, resample=Image.BICUBIC, reducing_gap=reducing_gap
+            )
+
+        if image.mode == "P" and "transparency" in image.info:
+            image = image.convert("RGBA")
+
+        if image.mode in ("RGBA", "LA"):
+            base.paste(image, coords, image)
+        else:
+            # Matching modes lets Pillow copy rows straight into the base
+            if image.mode != base.mode:
+                image = image.convert(base.mode)
+            base.paste(image, coords)
 
         return self.image_to_bytesio(base, format=format)
 
+    def writespec(self, spec: TextSpec, text: str) -> io.BytesIO:
+        return io.BytesIO(self.render_spec(spec, text))
+
+    def render_spec(self, spec: TextSpec, text: str) -> bytes:
+        data = self.output_cache.get((spec, text))
+        if data is None:
+            data = self._render_spec(spec, text)
+            self.output_cache.put((spec, text), data)
+        return data
+
+    def _render_spec(
+        self, spec: TextSpec, text: str, image: Optional[Image.Image] = None
+    ) -> bytes:
+        return self.writetext(
+            spec.image if image is None else image,
+            fontname=spec.fontname,
+            size=spec.size,
+            center=spec.center,
+            text=text,
+            fill=spec.fill,
+            format=spec.format,
+            return_type=bytes,
+        )
+
     @overload
     def writetext(
         self,
@@ -252,8 +568,9 @@ class BaseImageGenerator:
         text = text.strip()
 
         font = self.font_cache[fontname, size]
-        length = max([font.getlength(t) for t in text.split("\n")])
-        height = size * len(text.split("\n"))
+        lines = text.split("\n")
+        length = max([font.getlength(line) for line in lines])
+        height = size * len(lines)
         xy = (center[0] - length // 2, center[1] - height // 2)
 
         draw = ImageDraw.Draw(image)
@@ -266,6 +583,6 @@ class BaseImageGenerator:
             return self.image_to_bytesio(image, format=format)
 
         if issubclass(return_type, bytes):
-            return self.image_to_bytesio(image, format=format).read()
+            return self.image_to_bytes(image, format=format)
 
         raise RuntimeError(f"Unknown return_type {return_type.__name__}")
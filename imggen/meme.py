@@ -1,7 +1,10 @@
+import io
+import itertools
 import os
 import pathlib
 
 from concurrent.futures import Executor
+from typing import Dict, List, Optional, Sequence, cast
 
 from PIL import Image
 
@@ -10,17 +13,42 @@ from .core import (
     FontCacheDict,
     ImageCacheDict,
     ImageType,
+    SharedImageDict,
+    TextSpec,
     generator,
+    text_generator,
 )
 
+MEMES: Dict[str, TextSpec] = {
+    "worthless": TextSpec("worthless.jpg", "OpenSans-Light.ttf", 100, (678, 423)),
+    "sleep": TextSpec("sleep.png", "OpenSans-Light.ttf", 65, (190, 463), format="PNG"),
+    "pupil": TextSpec("pupil.jpg", "OpenSans-Light.ttf", 40, (135, 354)),
+    "kidsupset": TextSpec("kids upset.png", "OpenSans-Light.ttf", 100, (932, 452)),
+    "spongebob": TextSpec("spongebob.jpg", "OpenSans-Light.ttf", 50, (145, 183)),
+    "wojcry": TextSpec("hidethepain.jpg", "OpenSans-Light.ttf", 30, (213, 33)),
+    "troll": TextSpec("troll.jpg", "OpenSans-Light.ttf", 35, (50, 42)),
+}
+
 
 class MemeGenerator(BaseImageGenerator):
+    undertaker1_size = 50
+    undertaker2_size = 30
+    font_sizes = tuple(
+        sorted(
+            {spec.size for spec in MEMES.values()}
+            | {undertaker1_size, undertaker2_size}
+        )
+    )
+
     def __init__(
         self,
         async_mode: bool = False,
         image_cache: ImageCacheDict = {},
         font_cache: FontCacheDict = {},
         executor: Executor = None,
+        preload: bool = True,
+        shared_image_cache: Optional[SharedImageDict] = None,
+        output_cache_bytes: int = 32 * 1024 * 1024,
     ):
         image_path = pathlib.Path(os.path.abspath(__file__)).parent / "images/meme/"
         font_path = pathlib.Path(os.path.abspath(__file__)).parent / "fonts/"
@@ -32,69 +60,32 @@ class MemeGenerator(BaseImageGenerator):
             font_cache=font_cache,
             async_mode=async_mode,
             executor=executor,
+            shared_image_cache=shared_image_cache,
+            output_cache_bytes=output_cache_bytes,
         )
 
+        if preload:
+            self.image_cache.preload()
+            self.font_cache.preload(self.font_sizes)
+
     @generator
     def wanted(self, pfpdata: ImageType):
         return self.paste("wanted.jpg", pfpdata, (269, 451), resize=(395, 395))
 
-    @generator
-    def worthless(self, text: str):
-        return self.writetext(
-            "worthless.jpg",
-            fontname="OpenSans-Light.ttf",
-            size=100,
-            center=(678, 423),
-            text=text,
-        )
-
-    @generator
-    def sleep(self, text: str):
-        return self.writetext(
-            "sleep.png",
-            fontname="OpenSans-Light.ttf",
-            size=65,
-            center=(190, 463),
-            text=text,
-            format="PNG",
-        )
-
-    @generator
-    def pupil(self, text: str):
-        return self.writetext(
-            "pupil.jpg",
-            fontname="OpenSans-Light.ttf",
-            size=40,
-            center=(135, 354),
-            text=text,
-        )
-
-    @generator
-    def kidsupset(self, text: str):
-        return self.writetext(
-            "kids upset.png",
-            fontname="OpenSans-Light.ttf",
-            size=100,
-            center=(932, 452),
-            text=text,
-        )
-
-    @generator
-    def spongebob(self, text: str):
-        return self.writetext(
-            "spongebob.jpg",
-            fontname="OpenSans-Light.ttf",
-            size=50,
-            center=(145, 183),
-            text=text,
-        )
+    worthless = text_generator(MEMES["worthless"])
+    sleep = text_generator(MEMES["sleep"])
+    pupil = text_generator(MEMES["pupil"])
+    kidsupset = text_generator(MEMES["kidsupset"])
+    spongebob = text_generator(MEMES["spongebob"])
+    wojcry = text_generator(MEMES["wojcry"])
+    troll = text_generator(MEMES["troll"])
 
     @generator
     def undertaker1(self, text1: str, text2: str):
         img = self.writetext(
             "undertaker 1.jpg",
             fontname="OpenSans-Light.ttf",
-            size=50,
+            size=self.undertaker1_size,
             center=(348, 444),
             text=text1,
             return_type=Image.Image,
@@ -104,7 +95,7 @@ class MemeGenerator(BaseImageGenerator):
         return self.writetext(
             img,
             fontname="OpenSans-Light.ttf",
-            size=50,
+            size=self.undertaker1_size,
             center=(549, 176),
             text=text2,
             fill=(355, 355, 355),
@@ -115,7 +106,7 @@ class MemeGenerator(BaseImageGenerator):
         img = self.writetext(
             "undertaker 2.jpg",
             fontname="OpenSans-Light.ttf",
-            size=30,
+            size=self.undertaker2_size,
             center=(174, 100),
             text=text1,
             return_type=Image.Image,
@@ -125,28 +116,42 @@ class MemeGenerator(BaseImageGenerator):
         return self.writetext(
             img,
             fontname="OpenSans-Light.ttf",
-            size=30,
+            size=self.undertaker2_size,
             center=(156, 324),
             text=text2,
             fill=(355, 355, 355),
         )
 
     @generator
-    def wojcry(self, text: str):
-        return self.writetext(
-            "hidethepain.jpg",
-            fontname="OpenSans-Light.ttf",
-            size=30,
-            center=(213, 33),
-            text=text
-        )
-
-    @generator
-    def troll(self, text: str):
-        return self.writetext(
-            "troll.jpg",
-            fontname="OpenSans-Light.ttf",
-            size=35,
-            center=(50, 42),
-            text=text
-        )
+    def generate_batch(
+        self, names: Sequence[str], texts: Sequence[str]
+    ) -> List[io.BytesIO]:
+        if len(names) != len(texts):
+            raise ValueError("names and texts must be the same length")
+        specs = [MEMES[name] for name in names]
+
+        # Captions for the same template are drawn onto copies of one writable
+        # base fetched from the cache per group (for SharedImageCache this is
+        # also the only mode conversion); the last caption reuses it directly
+        results: List[Optional[io.BytesIO]] = [None] * len(specs)
+        order = sorted(range(len(specs)), key=lambda i: specs[i].image)
+        for image, group in itertools.groupby(order, key=lambda i: specs[i].image):
+            pending = []
+            for i in group:
+                data = self.output_cache.get((specs[i], texts[i]))
+                if data is None:
+                    pending.append(i)
+                else:
+                    results[i] = io.BytesIO(data)
+            if not pending:
+                continue
+
+            base = self.image_cache[image]
+            for n, i in enumerate(pending):
+                canvas = base if n == len(pending) - 1 else base.copy()
+                data = self._render_spec(specs[i], texts[i], canvas)
+                self.output_cache.put((specs[i], texts[i]), data)
+                results[i] = io.BytesIO(data)
+
+        # Every index was filled by exactly one of the branches above
+        return cast(List[io.BytesIO], results)
@@ -0,0 +1,58 @@
+from multiprocessing import shared_memory
+
+from imggen.meme import MemeGenerator
+
+
+def test_stale_shared_entry_is_replaced():
+    shared = {}
+    with MemeGenerator(shared_image_cache=shared, preload=False) as first:
+        first.image_cache.get_readonly("troll.jpg")
+        stale_name = shared["troll.jpg"][0]
+
+        # Simulate the creator exiting without close(): its resource tracker
+        # removes the segment but the shared entry is left behind
+        segment = shared_memory.SharedMemory(name=stale_name)
+        segment.unlink()
+        segment.close()
+
+        with MemeGenerator(shared_image_cache=shared, preload=False) as second:
+            assert second.troll("text").getvalue()
+            assert shared["troll.jpg"][0] != stale_name
+
+
+def test_close_keeps_entries_published_by_others():
+    shared = {}
+    with MemeGenerator(shared_image_cache=shared, preload=False) as gen:
+        gen.image_cache.get_readonly("troll.jpg")
+        # Another process replaced the entry after a stale-segment recovery
+        other = ("psm_other", (1, 1), "RGB", "RGBX")
+        shared["troll.jpg"] = other
+
+    assert shared["troll.jpg"] == other
+
+
+class RacingDict(dict):
+    # Misses the first lookup, as if this process checked before another
+    # process published the same template
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.raced = False
+
+    def get(self, key, default=None):
+        if not self.raced:
+            self.raced = True
+            return default
+        return super().get(key, default)
+
+
+def test_losing_publish_race_attaches_to_winner():
+    shared = {}
+    with MemeGenerator(shared_image_cache=shared, preload=False) as winner:
+        winner.image_cache.get_readonly("troll.jpg")
+
+        with MemeGenerator(shared_image_cache=shared, preload=False) as loser:
+            loser.image_cache.shared_dict = RacingDict(shared)
+            loser.image_cache.get_readonly("troll.jpg")
+
+            assert loser.image_cache.shared_dict["troll.jpg"] == shared["troll.jpg"]
+            assert not loser.image_cache.owned